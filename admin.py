@@ -1,9 +1,10 @@
 from django.contrib import admin
 
-from .models import Category, Ingredient, Product, Rating, Recipe
+from .models import Category, Ingredient, PendingGroupDeletion, Product, Rating, Recipe
 
 admin.site.register(Category)
 admin.site.register(Rating)
+admin.site.register(PendingGroupDeletion)
 
 
 class CategoryInline(admin.TabularInline):
@@ -0,0 +1,50 @@
+"""Helpers for running benchmarks against the app outside of a Django project."""
+
+import atexit
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+
+@lru_cache(maxsize=None)
+def app_pythonpath() -> str:
+    """Return a directory from which this checkout can be imported as ``shopping_list``."""
+    if APP_DIR.name == "shopping_list":
+        return str(APP_DIR.parent)
+    # A fresh directory per run, so we never measure another checkout's code through a stale link
+    path = Path(tempfile.mkdtemp(prefix="shopping_list_benchmarks_"))
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    (path / "shopping_list").symlink_to(APP_DIR, target_is_directory=True)
+    return str(path)
+
+
+SETUP_CODE = """
+import django
+from django.conf import settings
+
+settings.configure(
+    DEBUG=False,
+    SECRET_KEY="benchmark",
+    ALLOWED_HOSTS=["*"],
+    ROOT_URLCONF="shopping_list.urls",
+    INSTALLED_APPS=[
+        "django.contrib.contenttypes",
+        "django.contrib.auth",
+        "rest_framework",
+        "shopping_list",
+    ],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+django.setup()
+"""
+
+
+def setup():
+    """Configure Django in the current process with the app installed."""
+    sys.path.insert(0, app_pythonpath())
+    exec(SETUP_CODE, {})
@@ -0,0 +1,69 @@
+"""Compare payload size and serialize + render time of hyperlinked JSON and columnar JSON.
+
+Builds a throwaway in-memory database with one group, then renders its shopping list and product
+catalog both ways. Run from the app directory:
+
+    python -m benchmarks.payload [--rows N] [--repeat N]
+"""
+
+import argparse
+import timeit
+
+from ._django import setup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    setup()
+    from django.contrib.auth.models import Group
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from shopping_list.models import Category, Ingredient, Product
+    from shopping_list.renderers import ColumnarJSONRenderer
+    from shopping_list.serializers import (
+        CompactIngredientSerializer, CompactProductSerializer, IngredientSerializer, ProductSerializer,
+    )
+
+    call_command("migrate", verbosity=0)
+    group = Group.objects.create(name="shopping_group_benchmark")
+    category = Category.objects.create(name="Fruit and Veg", group=group)
+    Product.objects.bulk_create(
+        Product(name=f"Product {i}", pluralised_name=f"Products {i}", category=category, group=group)
+        for i in range(args.rows)
+    )
+    Ingredient.objects.bulk_create(
+        Ingredient(product=product, amount="2", on_shopping_list=True)
+        for product in Product.objects.filter(group=group)
+    )
+    # Load rows up front so only serialization and rendering are timed
+    products = list(Product.objects.filter(group=group))
+    ingredients = list(Ingredient.objects.select_related("product__category").filter(product__group=group))
+
+    request = Request(APIRequestFactory().get("/"))
+    cases = [
+        ("ingredients", "json", IngredientSerializer, JSONRenderer, ingredients),
+        ("ingredients", "columnar", CompactIngredientSerializer, ColumnarJSONRenderer, ingredients),
+        ("products", "json", ProductSerializer, JSONRenderer, products),
+        ("products", "columnar", CompactProductSerializer, ColumnarJSONRenderer, products),
+    ]
+    print(f"{'endpoint':<12} {'format':<10} {'bytes':>10} {'ms':>8}")
+    for endpoint, name, serializer_class, renderer_class, rows in cases:
+        def render():
+            data = serializer_class(rows, many=True, context={"request": request}).data
+            columns = list(serializer_class().fields)
+            return renderer_class().render(data, renderer_context={"columns": columns})
+
+        size = len(render())
+        seconds = min(timeit.repeat(render, number=1, repeat=args.repeat))
+        print(f"{endpoint:<12} {name:<10} {size:>10} {seconds * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Measure the cold start cost of a worker importing the app, and check it against our budget.
+
+Runs a fresh interpreter under ``python -X importtime`` which sets up Django and imports the URLconf,
+as a gunicorn worker or management command would. Run from the app directory:
+
+    python -m benchmarks.startup [--runs N]
+
+Exits non-zero if the median import time is over budget, or a module we load lazily was imported.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from ._django import SETUP_CODE, app_pythonpath
+
+BUDGET_FILE = Path(__file__).parent / "import_budget.json"
+
+WORKER_CODE = SETUP_CODE + """
+import shopping_list.urls
+"""
+
+
+def measure() -> tuple:
+    """Start one interpreter. Returns its total import time in microseconds and the modules it imported."""
+    env = dict(os.environ, PYTHONPATH=app_pythonpath())
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", WORKER_CODE],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        # Nested imports are indented under the module importing them, and counted in its cumulative time
+        if not name[1:].startswith(" "):
+            total += int(cumulative)
+    return total, modules
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    budget = json.loads(BUDGET_FILE.read_text())
+    # The first run warms up the bytecode cache and the filesystem
+    measure()
+    runs = [measure() for _ in range(args.runs)]
+    median = statistics.median(total for total, _ in runs)
+    imported = set().union(*(modules for _, modules in runs))
+
+    print(
+        f"Median import time: {median / 1000:.1f} ms "
+        f"(baseline {budget['baseline_median_us'] / 1000:.1f} ms, budget {budget['max_total_import_us'] / 1000:.1f} ms)"
+    )
+    failed = False
+    if median > budget["max_total_import_us"]:
+        print("Import time is over budget.")
+        failed = True
+    for module in budget["forbidden_modules"]:
+        if module in imported:
+            print(f"{module} was imported at startup; it should be loaded on first use.")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Request coalescing for group-scoped reads.
+
+Phones in a household tend to refresh at the same moment. Reads for the same group, endpoint and
+version share one computation, and its result is reused until the version changes.
+"""
+
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+
+from .conf import settings
+
+# Interval at which processes waiting on another process's computation poll for its result
+POLL_SECONDS = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run a function once per key at a time; concurrent callers with the same key share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_single_flight = SingleFlight()
+
+
+def coalesce_key(group_pk, endpoint: str, version, *variant) -> str:
+    """Build the key of a read. Variant covers anything else the result depends on, such as its format."""
+    digest = hashlib.md5("|".join(str(part) for part in variant).encode("utf-8")).hexdigest()
+    return f"coalesce-{group_pk}-{endpoint}-{version}-{digest}"
+
+
+def coalesced_read(key: str, compute):
+    """Return the cached result for key, computing it at most once at a time if it is missing.
+
+    The result must be picklable. Keys must change whenever the underlying data does.
+    """
+    result_key = f"{key}-result"
+    if (result := cache.get(result_key)) is not None:
+        return result
+    return _single_flight.do(key, lambda: _compute_and_store(key, result_key, compute))
+
+
+def _compute_and_store(key, result_key, compute):
+    if settings.SHOPPING_LIST_COALESCE_ACROSS_PROCESSES:
+        lock_key = f"{key}-lock"
+        lock_seconds = settings.SHOPPING_LIST_COALESCE_LOCK_SECONDS
+        deadline = time.monotonic() + lock_seconds
+        while not cache.add(lock_key, True, lock_seconds):
+            # Another process is computing the result; wait for it rather than repeating the work
+            if (result := cache.get(result_key)) is not None:
+                return result
+            if time.monotonic() > deadline:
+                # The other process may have died; give up waiting and compute it ourselves
+                return _store(result_key, compute())
+            time.sleep(POLL_SECONDS)
+        try:
+            # The result may have been stored just before we took the lock
+            if (result := cache.get(result_key)) is not None:
+                return result
+            return _store(result_key, compute())
+        finally:
+            cache.delete(lock_key)
+    return _store(result_key, compute())
+
+
+def _store(result_key, result):
+    cache.set(result_key, result, settings.SHOPPING_LIST_COALESCE_RESULT_SECONDS)
+    return result
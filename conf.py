@@ -0,0 +1,36 @@
+from django.conf import settings  # noqa: F401 - re-exported with our defaults applied
+from appconf import AppConf
+
+
+class ShoppingListConf(AppConf):
+    """Settings for the shopping list app. Override them as ``SHOPPING_LIST_<NAME>``."""
+
+    # Purge a group's data in a background thread once its last member leaves.
+    # Disable this to leave purging entirely to the ``purge_groups`` management command.
+    PURGE_GROUPS_IN_BACKGROUND = True
+    # Number of rows removed per statement when purging a group
+    GROUP_PURGE_BATCH_SIZE = 500
+
+    # Send safe-method API reads to a read replica. Requires ``shopping_list.routers.ReadReplicaRouter``
+    # in DATABASE_ROUTERS and a database with the alias below.
+    USE_READ_REPLICA = False
+    READ_REPLICA_ALIAS = "replica"
+    # After a write, a user's reads stay on the primary for this many seconds so they see their own writes
+    READ_YOUR_WRITES_SECONDS = 5
+
+    # Concurrent identical reads of a group's data share one computation within a process.
+    # Enable this to also share it across processes, through a lock in the cache.
+    COALESCE_ACROSS_PROCESSES = False
+    # How long other processes wait for the process holding the lock before computing the result themselves
+    COALESCE_LOCK_SECONDS = 10
+    # How long a computed result is kept. Results are keyed by version, so this doesn't affect freshness;
+    # keep it short so results of old versions don't pile up in the cache.
+    COALESCE_RESULT_SECONDS = 60
+
+    # How long a join token stays valid
+    GROUP_TOKEN_SECONDS = 86400
+    # Live join tokens kept per group; issuing another revokes the oldest
+    MAX_GROUP_TOKENS = 5
+
+    class Meta:
+        prefix = "shopping_list"
@@ -0,0 +1,115 @@
+"""Deferred jobs which are too heavy to run inside a request."""
+
+import logging
+import threading
+
+from django.contrib.auth.models import Group
+from django.db import connections, router, transaction
+
+from .conf import settings
+from .models import Category, Ingredient, PendingGroupDeletion, Product, Rating, Recipe
+from .tokens import TokenStoreBusy, revoke_group_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _delete_in_batches(queryset, batch_size: int) -> int:
+    """Delete every row of the queryset, at most batch_size rows per transaction.
+
+    Rows are removed with a raw DELETE, so no signals are sent and no cascades are collected in memory.
+    Callers are responsible for deleting dependent rows first.
+    """
+    model = queryset.model
+    using = router.db_for_write(model)
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            pks = list(queryset.using(using).values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            deleted += model._base_manager.using(using).filter(pk__in=pks)._raw_delete(using)
+
+
+def mark_group_for_deletion(group: Group):
+    """Hide the group from future use and purge its data once the current transaction commits."""
+    PendingGroupDeletion.objects.get_or_create(group=group)
+    # Nobody may join a group that is about to be purged. Joining also refuses groups pending deletion,
+    # so a busy token index mustn't stop the user from leaving.
+    try:
+        revoke_group_tokens(group.pk)
+    except TokenStoreBusy:
+        logger.warning("Could not revoke the join tokens of group %s", group.pk)
+    group_pk = group.pk
+    transaction.on_commit(lambda: schedule_group_purge(group_pk))
+
+
+def schedule_group_purge(group_pk: int):
+    """Purge the group in a background thread, unless purging is left to the management command."""
+    if not settings.SHOPPING_LIST_PURGE_GROUPS_IN_BACKGROUND:
+        return
+    thread = threading.Thread(target=_purge_group_in_thread, args=(group_pk,), daemon=True)
+    thread.start()
+
+
+def _purge_group_in_thread(group_pk: int):
+    try:
+        purge_group(group_pk)
+    except Exception:
+        # The group stays marked, so the management command will pick it up again
+        logger.exception("Failed to purge group %s", group_pk)
+    finally:
+        connections.close_all()
+
+
+class GroupNotPendingDeletion(Exception):
+    """Raised when asked to purge a group which was never marked for deletion."""
+
+
+def purge_group(group_pk: int, batch_size: int = None, force: bool = False) -> dict:
+    """Delete a group and everything it owns, in bounded batches.
+
+    Only groups marked for deletion are purged, unless force is given.
+    Returns the number of rows deleted per model.
+    """
+    if not force and not PendingGroupDeletion.objects.filter(group_id=group_pk).exists():
+        raise GroupNotPendingDeletion(f"Group {group_pk} is not pending deletion")
+    batch_size = batch_size or settings.SHOPPING_LIST_GROUP_PURGE_BATCH_SIZE
+    counts = {}
+
+    def _purge(queryset):
+        name = queryset.model._meta.label
+        counts[name] = counts.get(name, 0) + _delete_in_batches(queryset, batch_size)
+
+    # Children before parents, so that every foreign key still holds after each batch
+    _purge(Rating.objects.filter(recipe__group_id=group_pk))
+    _purge(Ingredient.objects.filter(product__group_id=group_pk))
+    _purge(Ingredient.objects.filter(recipe__group_id=group_pk))
+    _purge(Recipe.objects.filter(group_id=group_pk))
+    _purge(Product.objects.filter(group_id=group_pk))
+    # Products of other groups should never point at our categories, but don't let one block the purge
+    Product.objects.filter(category__group_id=group_pk).update(category=None)
+    _purge(Category.objects.filter(group_id=group_pk))
+
+    # Only the group itself, its marker and its memberships remain; a regular delete is cheap now
+    _, deleted = Group.objects.filter(pk=group_pk).delete()
+    counts["auth.Group"] = deleted.get("auth.Group", 0)
+    return counts
+
+
+def purge_pending_groups(batch_size: int = None) -> list:
+    """Purge every group marked for deletion, oldest first. Returns the purged group pks.
+
+    A group which fails to purge is logged and left marked, so the others are still purged.
+    """
+    group_pks = list(
+        PendingGroupDeletion.objects.order_by("requested_time").values_list("group_id", flat=True)
+    )
+    purged = []
+    for group_pk in group_pks:
+        try:
+            purge_group(group_pk, batch_size)
+        except Exception:
+            logger.exception("Failed to purge group %s", group_pk)
+        else:
+            purged.append(group_pk)
+    return purged
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...jobs import purge_group, purge_pending_groups
+from ...models import PendingGroupDeletion
+
+
+class Command(BaseCommand):
+    help = "Delete the data of groups whose last member has left."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "group_ids", nargs="*", type=int,
+            help="Only purge these groups. By default every group pending deletion is purged.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=None,
+            help="Rows deleted per statement. Defaults to SHOPPING_LIST_GROUP_PURGE_BATCH_SIZE.",
+        )
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Also purge the given groups if they are not pending deletion. Their data is lost for good.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["group_ids"]:
+            group_ids = options["group_ids"]
+            if not options["force"]:
+                # Check every group before purging any, so a mistyped id doesn't leave a job half done
+                pending = set(
+                    PendingGroupDeletion.objects.filter(group_id__in=group_ids).values_list("group_id", flat=True)
+                )
+                if not_pending := [group_id for group_id in group_ids if group_id not in pending]:
+                    raise CommandError(
+                        f"Groups {not_pending} are not pending deletion. Use --force to purge them anyway."
+                    )
+            for group_id in group_ids:
+                purge_group(group_id, batch_size, force=options["force"])
+        else:
+            group_ids = purge_pending_groups(batch_size)
+        self.stdout.write(f"Purged {len(group_ids)} group(s).")
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.3 on 2026-10-19 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('shopping_list', '0004_ingredient_added_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingGroupDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_time', models.DateTimeField(auto_now_add=True)),
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_deletion', to='auth.group')),
+            ],
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.contrib.auth.models import Group, User
-from django.db import models
+from django.db import models, router, transaction
 from django.urls import reverse
 
+from . import conf  # noqa: F401 - registers our settings defaults
+
 
 class Category(models.Model):
     """Type of product. Typically related to aisle."""
@@ -13,6 +15,21 @@ class Category(models.Model):
     def sorting_weight_default():
         pass
 
+    def save(self, *args, **kwargs):
+        # Categories given no weight go to the end of their group's order
+        if self._state.adding and self.sorting_weight == 0:
+            using = kwargs.get("using") or router.db_for_write(Category, instance=self)
+            # Locking the group row serialises concurrent inserts, so two new categories can never be
+            # given the same weight. Both reads go to the database we write to, never a replica.
+            with transaction.atomic(using=using):
+                list(Group.objects.using(using).select_for_update().filter(pk=self.group_id).values_list("pk"))
+                highest = Category.objects.using(using).filter(group_id=self.group_id).aggregate(
+                    highest=models.Max("sorting_weight")
+                )["highest"]
+                self.sorting_weight = 0 if highest is None else highest + 1
+                return super().save(*args, **kwargs)
+        return super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
@@ -93,3 +110,13 @@ class Ingredient(models.Model):
     def __str__(self):
         amount = f"{self.amount}" if self.amount else ""
         return f"{amount} {self.product.name}".strip()
+
+
+class PendingGroupDeletion(models.Model):
+    """Marks a group whose data is waiting to be purged by a background job."""
+
+    group = models.OneToOneField(Group, on_delete=models.CASCADE, related_name="pending_deletion")
+    requested_time = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Deletion of {self.group}"
@@ -0,0 +1,30 @@
+from rest_framework import renderers
+
+
+def to_columnar(data, fields=None):
+    """Turn a list of objects into a field list plus one array of values per object.
+
+    Pass the serializer's fields, so that the columns don't depend on the rows and an empty list still has them.
+    Anything other than a list of objects, such as a single object or an error, is returned unchanged.
+    """
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return data
+    if fields is None:
+        fields = list(data[0]) if data else []
+    return {"fields": fields, "rows": [[row.get(field) for field in fields] for row in data]}
+
+
+class ColumnarJSONRenderer(renderers.JSONRenderer):
+    """Compact JSON for list endpoints, which doesn't repeat key names on every row.
+
+    Select it with ``Accept: application/vnd.shopping-list.columnar+json`` or ``?format=columnar``.
+    Views serve ids instead of hyperlinks with this renderer, and pass their serializer's field names
+    as ``columns`` in the renderer context; see ``CompactRenderMixin``.
+    """
+
+    media_type = "application/vnd.shopping-list.columnar+json"
+    format = "columnar"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        columns = (renderer_context or {}).get("columns")
+        return super().render(to_columnar(data, columns), accepted_media_type, renderer_context)
@@ -0,0 +1,78 @@
+"""Database routing which sends API reads to a read replica.
+
+Add ``"shopping_list.routers.ReadReplicaRouter"`` to DATABASE_ROUTERS, configure a database under
+SHOPPING_LIST_READ_REPLICA_ALIAS and set SHOPPING_LIST_USE_READ_REPLICA. Writes are left to Django's default
+routing, so they go to the ``default`` database unless another router says otherwise.
+The routing tests use two separate SQLite databases; see ``shopping_list.test_settings``.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import cache
+
+from .conf import settings
+
+DEFAULT_DB_ALIAS = "default"
+
+# Whether the code currently running may read from the replica. Only set for safe API requests.
+_replica_reads = ContextVar("shopping_list_replica_reads", default=False)
+
+
+def _pin_key(user_pk) -> str:
+    return f"db-pin-primary-{user_pk}"
+
+
+def replica_enabled() -> bool:
+    return (
+        settings.SHOPPING_LIST_USE_READ_REPLICA
+        and settings.SHOPPING_LIST_READ_REPLICA_ALIAS in settings.DATABASES
+    )
+
+
+def pin_to_primary(user):
+    """Keep the user's reads on the primary for a short while, so they see their own writes."""
+    if user.is_authenticated and replica_enabled():
+        cache.set(_pin_key(user.pk), True, settings.SHOPPING_LIST_READ_YOUR_WRITES_SECONDS)
+
+
+def is_pinned_to_primary(user) -> bool:
+    return user.is_authenticated and bool(cache.get(_pin_key(user.pk)))
+
+
+def allow_replica_reads(allowed: bool = True):
+    """Allow (or forbid) reads from the replica. Returns a token for reset_replica_reads."""
+    return _replica_reads.set(allowed)
+
+
+def reset_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def replica_reads(allowed: bool = True):
+    """Allow (or forbid) reads from the replica within the block."""
+    token = allow_replica_reads(allowed)
+    try:
+        yield
+    finally:
+        reset_replica_reads(token)
+
+
+class ReadReplicaRouter:
+    """Route reads to the replica where allowed. Everything else is left to other routers and Django's defaults."""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and replica_enabled():
+            return settings.SHOPPING_LIST_READ_REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, settings.SHOPPING_LIST_READ_REPLICA_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
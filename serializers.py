@@ -20,7 +20,14 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
     group = serializers.PrimaryKeyRelatedField(read_only=True)
     class Meta:
         model = Category
-        fields = ['url', 'id', 'name', 'group']
+        fields = ['url', 'id', 'name', 'group', 'sorting_weight']
+        # Order is assigned on creation and changed through the reorder endpoint
+        read_only_fields = ['sorting_weight']
+
+
+class CategoryOrderSerializer(serializers.Serializer):
+    """The full, ordered list of a group's category ids."""
+    order = serializers.ListField(child=serializers.IntegerField())
 
 
 class ProductSerializer(serializers.HyperlinkedModelSerializer):
@@ -49,3 +56,23 @@ class IngredientSerializer(serializers.HyperlinkedModelSerializer):
         model = Ingredient
         fields = ['url', 'id', 'product', 'name', 'pluralised_name', 'recipe', 'category', 'added_by', 'added_time', 'on_shopping_list', 'amount']
 
+
+# Compact variants identify related objects by id rather than by hyperlink, for ColumnarJSONRenderer
+
+class CompactProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'category', 'pluralised_name', 'group']
+        read_only_fields = ['group']
+
+
+class CompactIngredientSerializer(serializers.ModelSerializer):
+    name = serializers.ReadOnlyField(source='product.name')
+    pluralised_name = serializers.ReadOnlyField(source='product.pluralised_name')
+    # Uncategorised products would otherwise drop the key, and every row must have the same columns
+    category = serializers.ReadOnlyField(source='product.category.name', default=None)
+
+    class Meta:
+        model = Ingredient
+        fields = ['id', 'product', 'name', 'pluralised_name', 'recipe', 'category', 'added_by', 'added_time', 'on_shopping_list', 'amount']
+        read_only_fields = ['added_by']
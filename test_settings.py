@@ -0,0 +1,34 @@
+"""Settings for running the app's tests on their own, with two SQLite databases for replica routing:
+
+    python -m django test shopping_list --settings=shopping_list.test_settings
+
+Run from the directory containing the app. The replica is a separate database, not a TEST MIRROR of
+the primary, so the routing tests can tell which one was queried.
+"""
+
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+
+SECRET_KEY = "shopping-list-tests"
+DEBUG = False
+ALLOWED_HOSTS = ["*"]
+ROOT_URLCONF = "shopping_list.urls"
+USE_TZ = True
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django.contrib.auth",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "rest_framework",
+    "shopping_list",
+]
+
+DATABASES = {
+    "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "test_default.sqlite3"},
+    "replica": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "test_replica.sqlite3"},
+}
+
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
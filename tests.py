@@ -1,3 +1,496 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections, router
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .coalesce import SingleFlight, coalesce_key, coalesced_read
+from .jobs import GroupNotPendingDeletion, purge_group
+from .models import Category, Ingredient, PendingGroupDeletion, Product, Rating, Recipe
+from .routers import _replica_reads
+from .tokens import TokenStoreBusy, issue_group_token, redeem_group_token, revoke_group_tokens
+from .util import read_shopping_hash, update_shopping_hash
+
+
+def create_group_with_data(name, user=None, rows=3):
+    """Create a shopping group holding a few rows of every model it owns."""
+    group = Group.objects.create(name=name)
+    if user:
+        user.groups.add(group)
+    for i in range(rows):
+        category = Category.objects.create(name=f"Category {i}", group=group)
+        product = Product.objects.create(name=f"Product {i}", pluralised_name=f"Products {i}", category=category, group=group)
+        recipe = Recipe.objects.create(name=f"Recipe {i}", group=group, added_by=user)
+        Ingredient.objects.create(product=product, recipe=recipe)
+        Ingredient.objects.create(product=product, on_shopping_list=True)
+        if user:
+            Rating.objects.create(recipe=recipe, user=user, value=i)
+    return group
+
+
+def group_row_counts(group):
+    return {
+        "ratings": Rating.objects.filter(recipe__group=group).count(),
+        "ingredients": Ingredient.objects.filter(product__group=group).count(),
+        "recipes": Recipe.objects.filter(group=group).count(),
+        "products": Product.objects.filter(group=group).count(),
+        "categories": Category.objects.filter(group=group).count(),
+    }
+
+
+@override_settings(SHOPPING_LIST_PURGE_GROUPS_IN_BACKGROUND=False)
+class GroupPurgeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice")
+        self.other_user = User.objects.create_user("bob")
+        self.group = create_group_with_data("shopping_group_1", self.user)
+        self.other_group = create_group_with_data("shopping_group_2", self.other_user)
+
+    def test_leave_by_last_member_marks_group_and_keeps_data(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        counts = group_row_counts(self.group)
+
+        response = client.post("/groups/leave/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(PendingGroupDeletion.objects.filter(group=self.group).exists())
+        self.assertEqual(group_row_counts(self.group), counts)
+        self.assertFalse(self.user.groups.exists())
+
+    def test_purge_group_removes_everything_in_batches(self):
+        PendingGroupDeletion.objects.create(group=self.group)
+        other_counts = group_row_counts(self.other_group)
+
+        counts = purge_group(self.group.pk, batch_size=2)
+
+        self.assertEqual(counts["shopping_list.Rating"], 3)
+        self.assertEqual(counts["shopping_list.Ingredient"], 6)
+        self.assertEqual(counts["auth.Group"], 1)
+        self.assertFalse(Group.objects.filter(pk=self.group.pk).exists())
+        self.assertFalse(Rating.objects.filter(user=self.user).exists())
+        self.assertFalse(Ingredient.objects.exclude(product__group=self.other_group).exists())
+        self.assertFalse(Recipe.objects.exclude(group=self.other_group).exists())
+        self.assertFalse(Product.objects.exclude(group=self.other_group).exists())
+        self.assertFalse(Category.objects.exclude(group=self.other_group).exists())
+        self.assertFalse(PendingGroupDeletion.objects.exists())
+        # Another group's rows are untouched
+        self.assertEqual(group_row_counts(self.other_group), other_counts)
+
+    def test_purge_group_refuses_groups_not_pending_deletion(self):
+        with self.assertRaises(GroupNotPendingDeletion):
+            purge_group(self.other_group.pk)
+        self.assertTrue(Group.objects.filter(pk=self.other_group.pk).exists())
+
+    def test_command_purges_pending_groups(self):
+        PendingGroupDeletion.objects.create(group=self.group)
+
+        call_command("purge_groups", "--batch-size=2", stdout=StringIO())
+
+        self.assertFalse(Group.objects.filter(pk=self.group.pk).exists())
+        self.assertTrue(Group.objects.filter(pk=self.other_group.pk).exists())
+
+    def test_command_needs_force_for_groups_not_pending_deletion(self):
+        PendingGroupDeletion.objects.create(group=self.group)
+
+        with self.assertRaises(CommandError):
+            call_command("purge_groups", str(self.group.pk), str(self.other_group.pk), stdout=StringIO())
+        # Nothing is purged if any of the groups is refused
+        self.assertTrue(Group.objects.filter(pk=self.group.pk).exists())
+        self.assertTrue(Group.objects.filter(pk=self.other_group.pk).exists())
+
+        call_command("purge_groups", str(self.other_group.pk), "--force", stdout=StringIO())
+        self.assertFalse(Group.objects.filter(pk=self.other_group.pk).exists())
+
+
+class CategoryOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("alice")
+        self.group = Group.objects.create(name="shopping_group_1")
+        self.user.groups.add(self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_new_categories_go_to_the_end(self):
+        weights = [Category.objects.create(name=f"Category {i}", group=self.group).sorting_weight for i in range(3)]
+        self.assertEqual(weights, [0, 1, 2])
+        # Weights are counted per group
+        other_group = Group.objects.create(name="shopping_group_2")
+        self.assertEqual(Category.objects.create(name="Other", group=other_group).sorting_weight, 0)
+
+    def test_explicit_weight_is_kept(self):
+        Category.objects.create(name="First", group=self.group)
+        self.assertEqual(Category.objects.create(name="Second", group=self.group, sorting_weight=7).sorting_weight, 7)
+
+    def test_reorder_applies_order(self):
+        categories = [Category.objects.create(name=f"Category {i}", group=self.group) for i in range(3)]
+        order = [categories[2].pk, categories[0].pk, categories[1].pk]
+
+        response = self.client.post("/categories/reorder/", {"order": order}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([category["id"] for category in response.data], order)
+        self.assertEqual(list(Category.objects.filter(group=self.group).order_by("sorting_weight").values_list("pk", flat=True)), order)
+
+    def test_reorder_rejects_incomplete_duplicate_or_foreign_ids(self):
+        categories = [Category.objects.create(name=f"Category {i}", group=self.group) for i in range(3)]
+        foreign = Category.objects.create(name="Foreign", group=Group.objects.create(name="shopping_group_2"))
+        pks = [category.pk for category in categories]
+
+        for order in (pks[:2], [pks[0], pks[0], pks[1], pks[2]], [*pks[:2], foreign.pk], "not a list", [*pks[:2], "x"]):
+            with self.subTest(order=order):
+                response = self.client.post("/categories/reorder/", {"order": order}, format="json")
+                self.assertEqual(response.status_code, 400)
+        # A bare list rather than an object
+        self.assertEqual(self.client.post("/categories/reorder/", pks, format="json").status_code, 400)
+        self.assertEqual([category.sorting_weight for category in Category.objects.filter(pk__in=pks).order_by("pk")], [0, 1, 2])
+
+
+class ColumnarRenderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice")
+        self.group = Group.objects.create(name="shopping_group_1")
+        self.user.groups.add(self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_columnar(self, path):
+        response = self.client.get(path, HTTP_ACCEPT="application/vnd.shopping-list.columnar+json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.shopping-list.columnar+json")
+        return json.loads(response.content)
+
+    def test_empty_list_has_columns(self):
+        data = self.get_columnar("/ingredients/get_shopping/")
+        self.assertIn("category", data["fields"])
+        self.assertNotIn("url", data["fields"])
+        self.assertEqual(data["rows"], [])
+
+    def test_columns_do_not_depend_on_first_row(self):
+        uncategorised = Product.objects.create(name="Apple", pluralised_name="Apples", group=self.group)
+        category = Category.objects.create(name="Dairy", group=self.group)
+        categorised = Product.objects.create(name="Milk", pluralised_name="Milk", group=self.group, category=category)
+        Ingredient.objects.create(product=uncategorised, on_shopping_list=True)
+        Ingredient.objects.create(product=categorised, on_shopping_list=True)
+
+        data = self.get_columnar("/ingredients/get_shopping/")
+
+        column = data["fields"].index("category")
+        self.assertEqual(sorted(row[column] or "" for row in data["rows"]), ["", "Dairy"])
+        self.assertEqual(data["fields"][:2], ["id", "product"])
+        self.assertEqual({row[1] for row in data["rows"]}, {uncategorised.pk, categorised.pk})
+
+
+def run_in_threads(count, target):
+    """Call target from count threads at once, and return their results or exceptions in order."""
+    results = [None] * count
+    barrier = threading.Barrier(count)
+
+    def _run(i):
+        barrier.wait()
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=_run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+class SlowCompute:
+    """A computation which takes long enough for concurrent callers to pile up on it."""
+
+    def __init__(self, result=None, error=None, seconds=0.2):
+        self.calls = 0
+        self.result = result
+        self.error = error
+        self.seconds = seconds
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.seconds)
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class SingleFlightTests(TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        single_flight = SingleFlight()
+        compute = SlowCompute(result=["milk"])
+
+        results = run_in_threads(8, lambda: single_flight.do("key", compute))
+
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual(results, [["milk"]] * 8)
+
+    def test_error_reaches_every_caller(self):
+        single_flight = SingleFlight()
+        compute = SlowCompute(error=RuntimeError("database went away"))
+
+        results = run_in_threads(8, lambda: single_flight.do("key", compute))
+
+        self.assertEqual(compute.calls, 1)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        # A failed call is not remembered
+        self.assertEqual(single_flight.do("key", lambda: "retried"), "retried")
+
+
+class CoalescedReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_reads_share_one_computation(self):
+        compute = SlowCompute(result=["milk"])
+        key = coalesce_key(1, "get_shopping", 5, "json")
+
+        results = run_in_threads(8, lambda: coalesced_read(key, compute))
+
+        self.assertEqual(results, [["milk"]] * 8)
+        self.assertEqual(compute.calls, 1)
+        # Reused until the version changes
+        self.assertEqual(coalesced_read(key, compute), ["milk"])
+        self.assertEqual(compute.calls, 1)
+
+    def test_new_version_recomputes(self):
+        coalesced_read(coalesce_key(1, "get_shopping", 5, "json"), lambda: ["milk"])
+
+        result = coalesced_read(coalesce_key(1, "get_shopping", 6, "json"), lambda: ["milk", "eggs"])
+
+        self.assertEqual(result, ["milk", "eggs"])
+
+    def test_empty_results_are_reused(self):
+        compute = SlowCompute(result=[], seconds=0)
+        key = coalesce_key(1, "get_shopping", 5, "json")
+        coalesced_read(key, compute)
+        coalesced_read(key, compute)
+        self.assertEqual(compute.calls, 1)
+
+    @override_settings(SHOPPING_LIST_COALESCE_ACROSS_PROCESSES=True)
+    def test_across_processes_computes_once_and_releases_lock(self):
+        compute = SlowCompute(result=["milk"])
+        key = coalesce_key(1, "get_shopping", 5, "json")
+
+        results = run_in_threads(8, lambda: coalesced_read(key, compute))
+
+        self.assertEqual(results, [["milk"]] * 8)
+        self.assertEqual(compute.calls, 1)
+        self.assertIsNone(cache.get(f"{key}-lock"))
+
+    @override_settings(SHOPPING_LIST_COALESCE_ACROSS_PROCESSES=True)
+    def test_across_processes_waits_for_lock_holder(self):
+        key = coalesce_key(1, "get_shopping", 5, "json")
+        # Another process holds the lock, and stores its result a little later
+        cache.add(f"{key}-lock", True, 10)
+        timer = threading.Timer(0.2, lambda: cache.set(f"{key}-result", ["from another process"]))
+        timer.start()
+        compute = SlowCompute(result=["computed here"], seconds=0)
+
+        result = coalesced_read(key, compute)
+
+        timer.join()
+        self.assertEqual(result, ["from another process"])
+        self.assertEqual(compute.calls, 0)
+
+    @override_settings(SHOPPING_LIST_COALESCE_ACROSS_PROCESSES=True, SHOPPING_LIST_COALESCE_LOCK_SECONDS=0.2)
+    def test_across_processes_computes_after_lock_deadline(self):
+        key = coalesce_key(1, "get_shopping", 5, "json")
+        # A process which died while holding the lock
+        cache.add(f"{key}-lock", True, 10)
+        compute = SlowCompute(result=["computed here"], seconds=0)
+
+        result = coalesced_read(key, compute)
+
+        self.assertEqual(result, ["computed here"])
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual(cache.get(f"{key}-result"), ["computed here"])
+
+
+class ShoppingHashTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice")
+        self.group = Group.objects.create(name="shopping_group_1")
+        self.user.groups.add(self.group)
+        self.product = Product.objects.create(name="Milk", pluralised_name="Milk", group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_concurrent_updates_give_distinct_hashes(self):
+        read_shopping_hash(self.user)
+        # The threads' own connections can't see this test's uncommitted group, so resolve it up front
+        with mock.patch("shopping_list.util.get_shopping_list_group", return_value=self.group):
+            hashes = run_in_threads(8, lambda: update_shopping_hash(self.user))
+        self.assertEqual(len(set(hashes)), 8)
+
+    def test_hash_changes_only_once_the_write_commits(self):
+        before = read_shopping_hash(self.user)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post("/ingredients/", {"product": f"http://testserver/products/{self.product.pk}/"}, format="json")
+            self.assertEqual(read_shopping_hash(self.user), before)
+        for callback in callbacks:
+            callback()
+
+        self.assertNotEqual(read_shopping_hash(self.user), before)
+
+    def test_get_shopping_is_recomputed_after_a_change(self):
+        self.assertEqual(self.client.get("/ingredients/get_shopping/").data, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/ingredients/",
+                {"product": f"http://testserver/products/{self.product.pk}/", "on_shopping_list": True},
+                format="json",
+            )
+
+        self.assertEqual([item["name"] for item in self.client.get("/ingredients/get_shopping/").data], ["Milk"])
+
+
+@override_settings(SHOPPING_LIST_MAX_GROUP_TOKENS=2)
+class GroupTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name="shopping_group_1")
+        self.joiner = User.objects.create_user("bob")
+        self.client = APIClient()
+        self.client.force_authenticate(self.joiner)
+
+    def join(self, token):
+        return self.client.post("/groups/test_join_code/", {"token": token}, format="json")
+
+    def test_join_with_token(self):
+        response = self.join(issue_group_token(self.group))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["name"], self.group.name)
+
+    def test_malformed_tokens_are_refused(self):
+        for token in (None, 12, "", f"{self.group.pk}", "x" * 43 + "!"):
+            with self.subTest(token=token):
+                self.assertIsNone(redeem_group_token(token))
+
+    def test_oldest_tokens_are_evicted(self):
+        tokens = [issue_group_token(self.group) for _ in range(3)]
+        self.assertIsNone(redeem_group_token(tokens[0]))
+        self.assertEqual([redeem_group_token(token) for token in tokens[1:]], [self.group.pk] * 2)
+
+    def test_revoked_tokens_are_refused(self):
+        token = issue_group_token(self.group)
+        revoke_group_tokens(self.group.pk)
+        self.assertIsNone(redeem_group_token(token))
+
+    def test_busy_index_fails_instead_of_losing_updates(self):
+        token = issue_group_token(self.group)
+        # Another request holds the index lock
+        cache.add(f"shopping-list-token-index:{self.group.pk}-lock", True, 10)
+        with mock.patch("shopping_list.tokens.INDEX_LOCK_POLL_SECONDS", 0):
+            with self.assertRaises(TokenStoreBusy):
+                issue_group_token(self.group)
+            with self.assertRaises(TokenStoreBusy):
+                revoke_group_tokens(self.group.pk)
+            member = User.objects.create_user("alice")
+            member.groups.add(self.group)
+            client = APIClient()
+            client.force_authenticate(member)
+            self.assertEqual(client.post("/groups/get_join_code/").status_code, 503)
+        # Nothing was lost or left half written
+        self.assertEqual(cache.get(f"shopping-list-token-index:{self.group.pk}"), [token])
+        self.assertEqual(redeem_group_token(token), self.group.pk)
+
+    def test_single_use_token_is_redeemed_once(self):
+        token = issue_group_token(self.group, single_use=True)
+        results = run_in_threads(8, lambda: redeem_group_token(token))
+        self.assertEqual(results.count(self.group.pk), 1)
+        self.assertEqual(results.count(None), 7)
+
+    def test_groups_pending_deletion_or_gone_cannot_be_joined(self):
+        # Tokens which survived revocation, e.g. because the index was evicted
+        token = issue_group_token(self.group)
+        PendingGroupDeletion.objects.create(group=self.group)
+        self.assertEqual(self.join(token).data, {})
+
+        gone = Group.objects.create(name="shopping_group_2")
+        token = issue_group_token(gone)
+        gone.delete()
+        response = self.join(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.joiner.groups.exists())
+
+
+@skipUnless("replica" in settings.DATABASES, "Needs a second database with the alias 'replica'")
+@override_settings(
+    DATABASE_ROUTERS=["shopping_list.routers.ReadReplicaRouter"],
+    SHOPPING_LIST_USE_READ_REPLICA=True,
+    SHOPPING_LIST_READ_REPLICA_ALIAS="replica",
+)
+class ReadReplicaRoutingTests(TestCase):
+    # Django sets up the databases of skipped tests too, so only ask for the replica when it exists
+    databases = {"default", "replica"} if "replica" in settings.DATABASES else {"default"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("alice")
+        self.group = Group.objects.create(name="shopping_group_1")
+        self.user.groups.add(self.group)
+        self.category = Category.objects.create(name="Dairy", group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertReadsFrom(self, alias, method, *args, **kwargs):
+        """Make a request, and check that only the given database was queried."""
+        other = "replica" if alias == "default" else "default"
+        with CaptureQueriesContext(connections[alias]) as used, CaptureQueriesContext(connections[other]) as unused:
+            response = method(*args, **kwargs)
+        self.assertLess(response.status_code, 400)
+        self.assertTrue(used.captured_queries)
+        self.assertFalse(unused.captured_queries)
+        return response
+
+    def test_get_reads_from_replica(self):
+        self.assertReadsFrom("replica", self.client.get, "/categories/")
+
+    def test_writes_go_to_default(self):
+        self.assertReadsFrom("default", self.client.post, "/categories/", {"name": "Bakery"}, format="json")
+        self.assertTrue(Category.objects.using("default").filter(name="Bakery").exists())
+        self.assertFalse(Category.objects.using("replica").filter(name="Bakery").exists())
+
+        cache.clear()
+        self.assertReadsFrom("default", self.client.patch, f"/categories/{self.category.pk}/", {"name": "Milk"}, format="json")
+        self.assertEqual(Category.objects.using("default").get(pk=self.category.pk).name, "Milk")
+
+    def test_reads_stay_on_default_after_a_write(self):
+        self.client.post("/categories/", {"name": "Bakery"}, format="json")
+        self.assertReadsFrom("default", self.client.get, "/categories/")
+
+        # Other users are not pinned
+        other_client = APIClient()
+        other_client.force_authenticate(User.objects.create_user("bob"))
+        self.assertReadsFrom("replica", other_client.get, "/categories/")
+
+    def test_falls_back_to_default(self):
+        with self.settings(SHOPPING_LIST_USE_READ_REPLICA=False):
+            self.assertReadsFrom("default", self.client.get, "/categories/")
+        with self.settings(SHOPPING_LIST_READ_REPLICA_ALIAS="missing"):
+            self.assertReadsFrom("default", self.client.get, "/categories/")
+
+    def test_replica_reads_are_reset_after_the_response(self):
+        self.client.get("/categories/")
+        self.assertFalse(_replica_reads.get())
+        self.assertEqual(router.db_for_read(Category), "default")
@@ -0,0 +1,110 @@
+"""Join tokens, which let a user join the group of the member who shared them.
+
+Tokens live in the cache under a namespaced key holding the group's pk, so redeeming one needs no
+database query. Each group keeps an index of its live tokens, capped at SHOPPING_LIST_MAX_GROUP_TOKENS.
+"""
+
+import re
+import secrets
+import time
+from typing import Optional
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+
+from .conf import settings
+
+TOKEN_PREFIX = "shopping-list-token:"
+INDEX_PREFIX = "shopping-list-token-index:"
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_-]{43}")
+
+# Attempts to take a group's index lock, and how long to wait between them
+INDEX_LOCK_ATTEMPTS = 20
+INDEX_LOCK_POLL_SECONDS = 0.01
+
+
+class TokenStoreBusy(Exception):
+    """Raised when a group's token index is locked for too long; the caller should try again later."""
+
+
+def _token_key(token: str) -> str:
+    return f"{TOKEN_PREFIX}{token}"
+
+
+def _index_key(group_pk) -> str:
+    return f"{INDEX_PREFIX}{group_pk}"
+
+
+def _update_index(group_pk, update):
+    """Replace a group's token index with update(tokens), holding a lock so updates don't race.
+
+    Raises TokenStoreBusy if the lock can't be taken, rather than risk losing a concurrent update.
+    """
+    lock_key = f"{_index_key(group_pk)}-lock"
+    for _ in range(INDEX_LOCK_ATTEMPTS):
+        if cache.add(lock_key, True, 5):
+            break
+        time.sleep(INDEX_LOCK_POLL_SECONDS)
+    else:
+        raise TokenStoreBusy(f"The join token index of group {group_pk} is busy")
+    try:
+        tokens = update(cache.get(_index_key(group_pk), []))
+        if tokens:
+            cache.set(_index_key(group_pk), tokens, settings.SHOPPING_LIST_GROUP_TOKEN_SECONDS)
+        else:
+            cache.delete(_index_key(group_pk))
+    finally:
+        cache.delete(lock_key)
+
+
+def issue_group_token(group: Group, single_use: bool = False) -> str:
+    """Create a join token for the group, revoking its oldest tokens beyond the cap.
+
+    Raises TokenStoreBusy if the group's token index stays locked.
+    """
+    token = secrets.token_urlsafe(32)
+
+    def _add(tokens):
+        # Written under the index lock, so a concurrent revoke_group_tokens can't miss it
+        cache.set(_token_key(token), (group.pk, single_use), settings.SHOPPING_LIST_GROUP_TOKEN_SECONDS)
+        tokens = [*tokens, token]
+        evicted = tokens[:-settings.SHOPPING_LIST_MAX_GROUP_TOKENS]
+        if evicted:
+            cache.delete_many([_token_key(old) for old in evicted])
+        return tokens[-settings.SHOPPING_LIST_MAX_GROUP_TOKENS:]
+
+    _update_index(group.pk, _add)
+    return token
+
+
+def redeem_group_token(token) -> Optional[int]:
+    """Return the pk of the group the token joins, or None if it isn't a live token.
+
+    The group is not looked up, so callers must check that it still exists and isn't pending deletion.
+
+    A single use token is claimed by deleting it, which the cache does atomically, so only one
+    concurrent caller can redeem it.
+    """
+    if not isinstance(token, str) or not TOKEN_PATTERN.fullmatch(token):
+        return None
+    if (value := cache.get(_token_key(token))) is None:
+        return None
+    group_pk, single_use = value
+    if single_use:
+        if not cache.delete(_token_key(token)):
+            return None
+        try:
+            _update_index(group_pk, lambda tokens: [other for other in tokens if other != token])
+        except TokenStoreBusy:
+            # The token is already claimed; a stale index entry only means it is evicted early
+            pass
+    return group_pk
+
+
+def revoke_group_tokens(group_pk):
+    """Revoke every live join token of the group. Raises TokenStoreBusy if the index stays locked."""
+    def _clear(tokens):
+        cache.delete_many([_token_key(token) for token in tokens])
+        return []
+
+    _update_index(group_pk, _clear)
@@ -1,30 +1,51 @@
-import base64
+import json
 from os import urandom
-from functools import wraps
+from functools import lru_cache, wraps
+from pathlib import Path
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group, User
 from django.contrib.auth.mixins import AccessMixin
 from django.core.cache import cache
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.urls import reverse
-from fuzzywuzzy import process
 
 
 SECONDS_IN_DAY = 86400
 
 
+def _random_shopping_hash() -> int:
+    # Start from a random value, so a lost hash can't restart at a version that was already handed out
+    return int.from_bytes(urandom(4), "big") % int(1E+9) + 1
+
+
 def update_shopping_hash(user: User):
     group = get_shopping_list_group(user)
     hash_key = f"md5-shopping-{group.pk}"
-    if hash := cache.get(hash_key):
-        new_hash = hash + 1 if hash < 1E+9 else 1
-    else:
-        new_hash = 1
-    cache.set(hash_key, new_hash, SECONDS_IN_DAY)
+    # incr and add are atomic, so concurrent updates never hand out the same hash twice
+    try:
+        new_hash = cache.incr(hash_key)
+    except ValueError:
+        new_hash = _random_shopping_hash()
+        if cache.add(hash_key, new_hash, SECONDS_IN_DAY):
+            return new_hash
+        # Another request started the hash first
+        new_hash = cache.incr(hash_key)
+    if new_hash > 1E+9:
+        new_hash = _random_shopping_hash()
+        cache.set(hash_key, new_hash, SECONDS_IN_DAY)
     return new_hash
 
+
+def update_shopping_hash_on_commit(user: User):
+    """Update the hash once the current transaction commits.
+
+    Updating it earlier would let a concurrent reader cache the old list under the new hash.
+    """
+    transaction.on_commit(lambda: update_shopping_hash(user))
+
 def read_shopping_hash(user: User):
     """Read the MD5 hash of the current shopping list state."""
 
@@ -35,34 +56,28 @@ def read_shopping_hash(user: User):
     return update_shopping_hash(user)
 
 
-def generate_group_token(group: Group) -> str:
-    """Generate a random invitation link and put it in our cache."""
-
-    pk = group.pk
-    random_bytes = urandom(32)
-    key = base64.urlsafe_b64encode(random_bytes).decode('utf-8')
-    full_key = f"{pk}-{key}"
-    cache.set(full_key, pk, SECONDS_IN_DAY)
-    return full_key
-
-
-def test_group_token(key: str) -> Group:
-    """If the given key is in our cache, return the group it corresponds to."""
-    if pk := cache.get(key):
-        return Group.objects.get(pk=pk)
-
 def match_name(name, objects):
     matched_objects = objects.filter(name__iexact=name)
     if matched_objects.count():
         return matched_objects[0], True
     else:
-        # No matching results - return a list ordered with Levenshtein Distance
+        # No matching results - return a list ordered with Levenshtein Distance.
+        # fuzzywuzzy is slow to import and rarely needed, so only load it here.
+        from fuzzywuzzy import process
+
         best_name, best_score = process.extractOne(
             name, [trial.name for trial in objects.all()]
         )
         return objects.get(name=best_name), best_score > 90
 
 
+@lru_cache(maxsize=None)
+def load_template_group() -> dict:
+    """Read the data used to populate groups created from the template. Read from disk only once."""
+    with open(Path(__file__).parent / "template_group.json") as file:
+        return json.load(file)
+
+
 def get_shopping_list_group(user):
     """Get the 'Shopping List Group' of the user.
 
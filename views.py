@@ -1,31 +1,80 @@
 from django.contrib.auth.models import Group
 
-from rest_framework import viewsets, permissions, renderers
+from rest_framework import viewsets, permissions, renderers, serializers, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.settings import api_settings
+from django.db import router, transaction
 
 from .serializers import GroupSerializer, CategorySerializer, ProductSerializer, RecipeSerializer, IngredientSerializer, UserSerializer
+from .serializers import CategoryOrderSerializer, CompactIngredientSerializer, CompactProductSerializer
+from .renderers import ColumnarJSONRenderer
+from .coalesce import coalesce_key, coalesced_read
 from .models import Category, Ingredient, Recipe, Product
+from .jobs import mark_group_for_deletion
+from .tokens import TokenStoreBusy, issue_group_token, redeem_group_token
+from .routers import (
+    allow_replica_reads, is_pinned_to_primary, pin_to_primary, replica_enabled, replica_reads, reset_replica_reads,
+)
 from .util import (
     get_shopping_list_group, 
-    generate_group_token, 
-    test_group_token, 
     read_shopping_hash, 
-    update_shopping_hash
+    update_shopping_hash_on_commit,
+    load_template_group,
 )
 
 
 def _get_or_create_checklist(queryset, group):
     try:
-        recipe = queryset.get(name__exact="Auto", group=group)
+        # Look on the primary, as a lagging replica could make us create a second checklist
+        recipe = queryset.using(router.db_for_write(Recipe)).get(name__exact="Auto", group=group)
     except Recipe.DoesNotExist:
         # For the first time viewing the checklist we may need to create it
         recipe = Recipe(name="Auto", group=group)
         recipe.save()
     return recipe
 
+class ReplicaReadMixin:
+    """Serve safe requests from the read replica, unless the user has written very recently."""
+
+    _replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if replica_enabled() and request.method in permissions.SAFE_METHODS:
+            self._replica_token = allow_replica_reads(not is_pinned_to_primary(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._replica_token is not None:
+            reset_replica_reads(self._replica_token)
+            self._replica_token = None
+        elif request.method not in permissions.SAFE_METHODS:
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class CompactRenderMixin:
+    """Offer the columnar renderer, and serialize with ids rather than hyperlinks when it is chosen."""
+
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
+    compact_serializer_class = None
+
+    def get_serializer_class(self):
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if self.compact_serializer_class and isinstance(renderer, ColumnarJSONRenderer):
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def get_renderer_context(self):
+        context = super().get_renderer_context()
+        if isinstance(getattr(self.request, 'accepted_renderer', None), ColumnarJSONRenderer):
+            # Columns come from the serializer, not from whichever row happens to be first
+            context['columns'] = list(self.get_serializer().fields)
+        return context
+
+
 # ViewSets define the view behavior.
-class GroupViewSet(viewsets.ModelViewSet):
+class GroupViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = GroupSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -68,64 +117,61 @@ class GroupViewSet(viewsets.ModelViewSet):
         if self.has_no_group():
             group = self.__create_group()
             
-            # Load data files containing 'Template Group' data
-            import json
-            from pathlib import Path
-            with open(Path(__file__).parent / 'template_group.json') as file:
-                template_data = json.load(file)
-
-                # Add categories first
-                if "categories" in template_data:
-                    for category in template_data["categories"]:
-                        _category = Category(name=category, group=group)
-                        _category.save()
-
-                # Add products
-                if "products" in template_data:
-                    for product in template_data["products"]:
-                        plural_name = (product["pluralised_name"] 
-                                if "pluralised_name" in product else product["name"])
-                        if "category" in product:
-                            try:
-                                category = Category.objects.get(group=group, name__exact=product["category"])
-                            except Category.DoesNotExist as e:
-                                print(f"Category {product['category']} of product {product['name']} ({product}) does not exist")
-                                continue
-                        else:
-                            category = None
-                        _product = Product(name=product["name"], pluralised_name=plural_name, 
-                                group=group, category=category)
-                        _product.save()
-
-                # Small helper function for ingredient addition
-                def _add_ingredient(ingredient, _recipe=None, on_list=False):
-                    try:
-                        _product = Product.objects.get(group=group, name__exact=ingredient["name"])
-                        amount = ingredient["amount"] if "amount" in ingredient else ""
-                        _ingredient = Ingredient(product=_product, recipe=_recipe, amount=amount, on_shopping_list=on_list)
-                        _ingredient.save()
-                    except Product.DoesNotExist:
-                        print(f"Product {ingredient['name']} of ingredient {ingredient} does not exist")
-
-                # Add recipes
-                if "recipes" in template_data:
-                    for recipe in template_data["recipes"]:
-                        _recipe = Recipe(name=recipe["name"], source=recipe["source"], group=group)
-                        _recipe.save()
-
-                        for ingredient in recipe["ingredients"]:
-                            _add_ingredient(ingredient, _recipe)
-
-                # Add checklist
-                if "checklist" in template_data:
-                    _checklist = _get_or_create_checklist(Recipe.objects.filter(group=group), group)
-                    for ingredient in template_data["checklist"]:
-                        _add_ingredient(ingredient, _checklist)
-
-                # Add shopping
-                if "shopping" in template_data:
-                    for ingredient in template_data["shopping"]:
-                        _add_ingredient(ingredient, on_list=True)
+            # 'Template Group' data is loaded once, when the app starts
+            template_data = load_template_group()
+
+            # Add categories first
+            if "categories" in template_data:
+                for category in template_data["categories"]:
+                    _category = Category(name=category, group=group)
+                    _category.save()
+
+            # Add products
+            if "products" in template_data:
+                for product in template_data["products"]:
+                    plural_name = (product["pluralised_name"] 
+                            if "pluralised_name" in product else product["name"])
+                    if "category" in product:
+                        try:
+                            category = Category.objects.get(group=group, name__exact=product["category"])
+                        except Category.DoesNotExist as e:
+                            print(f"Category {product['category']} of product {product['name']} ({product}) does not exist")
+                            continue
+                    else:
+                        category = None
+                    _product = Product(name=product["name"], pluralised_name=plural_name, 
+                            group=group, category=category)
+                    _product.save()
+
+            # Small helper function for ingredient addition
+            def _add_ingredient(ingredient, _recipe=None, on_list=False):
+                try:
+                    _product = Product.objects.get(group=group, name__exact=ingredient["name"])
+                    amount = ingredient["amount"] if "amount" in ingredient else ""
+                    _ingredient = Ingredient(product=_product, recipe=_recipe, amount=amount, on_shopping_list=on_list)
+                    _ingredient.save()
+                except Product.DoesNotExist:
+                    print(f"Product {ingredient['name']} of ingredient {ingredient} does not exist")
+
+            # Add recipes
+            if "recipes" in template_data:
+                for recipe in template_data["recipes"]:
+                    _recipe = Recipe(name=recipe["name"], source=recipe["source"], group=group)
+                    _recipe.save()
+
+                    for ingredient in recipe["ingredients"]:
+                        _add_ingredient(ingredient, _recipe)
+
+            # Add checklist
+            if "checklist" in template_data:
+                _checklist = _get_or_create_checklist(Recipe.objects.filter(group=group), group)
+                for ingredient in template_data["checklist"]:
+                    _add_ingredient(ingredient, _checklist)
+
+            # Add shopping
+            if "shopping" in template_data:
+                for ingredient in template_data["shopping"]:
+                    _add_ingredient(ingredient, on_list=True)
             
             return self.get_group_response()
         return Response({})
@@ -133,30 +179,38 @@ class GroupViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def leave(self, request, *args, **kwargs):
         if group := self.get_group():
-            self.request.user.groups.remove(group)
-            if group.user_set.count() == 0:
-                group.delete()
+            with transaction.atomic():
+                self.request.user.groups.remove(group)
+                if group.user_set.count() == 0:
+                    # Deleting a long-lived group cascades through all of its data, so defer it
+                    mark_group_for_deletion(group)
         return self.get_group_response()
 
     @action(detail=False, methods=['post'])
     def get_join_code(self, request, *args, **kwargs):
         if group := self.get_group():
-            token = generate_group_token(group)
+            single_use = request.data.get('single_use') in (True, 'true')
+            try:
+                token = issue_group_token(group, single_use=single_use)
+            except TokenStoreBusy:
+                return Response({'detail': "Please try again."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
             return Response({'token': token})
         return Response({})
 
     @action(detail=False, methods=['post'])
     def test_join_code(self, request, *args, **kwargs):
         if self.has_no_group():
-            if group := test_group_token(request.data['token']):
-                self.request.user.groups.add(group)
+            if group_pk := redeem_group_token(request.data.get('token')):
+                # Revoked tokens can outlive the cache's token index, so check the group is still joinable
+                if Group.objects.filter(pk=group_pk, pending_deletion__isnull=True).exists():
+                    self.request.user.groups.add(group_pk)
         return self.get_group_response()
 
     def get_queryset(self):
         return self.request.user.groups.all()
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -176,11 +230,41 @@ class CategoryViewSet(viewsets.ModelViewSet):
                 response["data"] = CategorySerializer(queryset.all()[0], context={'request': request}).data
             return Response(response)
 
+    @action(detail=False, methods=['post'])
+    def reorder(self, request, *args, **kwargs):
+        """Set the order of all of the group's categories from a full, ordered list of their ids."""
+        order_serializer = CategoryOrderSerializer(data=request.data)
+        order_serializer.is_valid(raise_exception=True)
+        order = order_serializer.validated_data['order']
+
+        using = router.db_for_write(Category)
+        with transaction.atomic(using=using):
+            categories = {category.pk: category for category in self.get_queryset().using(using).select_for_update()}
+            if len(order) != len(set(order)) or set(order) != set(categories):
+                raise serializers.ValidationError({'order': "Must contain every category of the group exactly once."})
+            for weight, pk in enumerate(order):
+                categories[pk].sorting_weight = weight
+            # A single UPDATE ... CASE statement
+            Category.objects.using(using).bulk_update(categories.values(), ['sorting_weight'], batch_size=len(categories) or None)
+
+        ordered = [categories[pk] for pk in order]
+        return Response(CategorySerializer(ordered, many=True, context={'request': request}).data)
+
     def perform_create(self, serializer):
         serializer.save(group=get_shopping_list_group(self.request.user))
 
-class ProductViewSet(viewsets.ModelViewSet):
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # Shopping list items show their product's category name, so the list has changed
+        update_shopping_hash_on_commit(self.request.user)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        update_shopping_hash_on_commit(self.request.user)
+
+class ProductViewSet(ReplicaReadMixin, CompactRenderMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
+    compact_serializer_class = CompactProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def get_queryset(self):
@@ -200,16 +284,25 @@ class ProductViewSet(viewsets.ModelViewSet):
                 response["data"] = ProductSerializer(queryset.all()[0], context={'request': request}).data
             return Response(response)
 
-    @action(detail=False, methods=['get'], renderer_classes=[renderers.JSONRenderer])
+    @action(detail=False, methods=['get'], renderer_classes=[renderers.JSONRenderer, ColumnarJSONRenderer])
     def get_sorted_by_category(self, request, *args, **kwargs):
         queryset = self.get_queryset().order_by('category')
-        return Response(ProductSerializer(queryset.all(), many=True, context={'request': request}).data)
+        return Response(self.get_serializer(queryset.all(), many=True).data)
 
     def perform_create(self, serializer):
         serializer.save(group=get_shopping_list_group(self.request.user))
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # Shopping list items show their product's names and category, so the list has changed
+        update_shopping_hash_on_commit(self.request.user)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        update_shopping_hash_on_commit(self.request.user)
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
@@ -241,7 +334,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
             item.pk = None
             item.on_shopping_list = True
             item.save()
-        update_shopping_hash(self.request.user)
+        update_shopping_hash_on_commit(self.request.user)
         return Response({"status": 200})
 
     @action(detail=False, methods=['get'], renderer_classes=[renderers.JSONRenderer])
@@ -284,31 +377,44 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 item.pk = None
                 item.on_shopping_list = True
                 item.save()
-            update_shopping_hash(self.request.user)
+            update_shopping_hash_on_commit(self.request.user)
         return Response(None)
 
     def perform_create(self, serializer):
         serializer.save(added_by=self.request.user, group=get_shopping_list_group(self.request.user))
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # Shopping list items show the recipe they came from, so the list has changed
+        update_shopping_hash_on_commit(self.request.user)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        update_shopping_hash_on_commit(self.request.user)
+
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ReplicaReadMixin, CompactRenderMixin, viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
+    compact_serializer_class = CompactIngredientSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
     def destroy(self, request, pk=None):
+        on_shopping_list = False
         if self.request.user.is_authenticated:
             try:
-                ingredient = self.get_queryset().get(pk=pk)
-                if ingredient.on_shopping_list:
-                    update_shopping_hash(self.request.user)
+                on_shopping_list = self.get_queryset().get(pk=pk).on_shopping_list
             except Ingredient.DoesNotExist:
                 pass # Don't care
-        return super().destroy(request, pk)
+        response = super().destroy(request, pk)
+        if on_shopping_list:
+            update_shopping_hash_on_commit(self.request.user)
+        return response
 
     def create(self, request):
+        response = super().create(request)
         if self.request.user.is_authenticated:
-            update_shopping_hash(self.request.user)
-        return super().create(request)
+            update_shopping_hash_on_commit(self.request.user)
+        return response
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
@@ -318,8 +424,23 @@ class IngredientViewSet(viewsets.ModelViewSet):
 
     @action(detail=False)
     def get_shopping(self, request, *args, **kwargs):
-        items = self.get_queryset().filter(on_shopping_list=True)
-        return Response(IngredientSerializer(items, many=True, context={'request': request}).data)
+        def serialize():
+            items = self.get_queryset().filter(on_shopping_list=True)
+            return self.get_serializer(items, many=True).data
+
+        def serialize_from_primary():
+            # A lagging replica would have the old list cached under the new hash
+            with replica_reads(False):
+                return serialize()
+
+        if self.request.user.is_authenticated and (group := get_shopping_list_group(self.request.user)):
+            # Phones in a household refresh together; share one computation per version of the list
+            key = coalesce_key(
+                group.pk, "get_shopping", read_shopping_hash(self.request.user),
+                request.accepted_renderer.format, request.build_absolute_uri('/'),
+            )
+            return Response(coalesced_read(key, serialize_from_primary))
+        return Response(serialize())
 
     @action(detail=False)
     def get_shopping_hash(self, request, *args, **kwargs):
@@ -334,7 +455,11 @@ class IngredientViewSet(viewsets.ModelViewSet):
             items = Ingredient.objects.filter(recipe=recipe, on_shopping_list=on_shopping_list)
         else:
             items = Ingredient.objects.filter(on_shopping_list=True)
-        return Response(IngredientSerializer(items, many=True, context={'request': request}).data)
+        return Response(self.get_serializer(items, many=True).data)
 
     def perform_create(self, serializer):
         serializer.save(added_by=self.request.user)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        update_shopping_hash_on_commit(self.request.user)